@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
 # title: CoreRescue (v1.6 - Shadow Precision Fix)
 # author: TB
+# The sections from DEFERRED IMPORTS down to the tool class are shared, identical apart from
+# the tool name in messages, with StarRecombiner_v2.0.py; change both copies together.
 
-import os, time, tempfile, shutil, sys, subprocess
+import os, time, tempfile, sys, subprocess, threading, queue, math, argparse, glob, json, atexit, importlib.util
+START = time.perf_counter() # cold start is measured from here
+from collections import OrderedDict, deque, defaultdict
+from functools import lru_cache, wraps
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # --- AUTOMATIC INSTALLER LOGIC ---
 def check_and_install():
-    try:
-        from PIL import Image, ImageTk
-        from pysiril.siril import Siril as pySiril
-    except ImportError:
+    # Only looks the packages up; importing them waits until they are used (see Deferred)
+    if any(importlib.util.find_spec(m) is None for m in ("PIL", "pysiril", "numpy")):
         print("CoreRescue: Libraries missing. Downloading stable versions...")
         python_exe = sys.executable
         pysiril_url = "https://gitlab.com/-/project/20510105/uploads/8224707c29669f255ad43da3b93bc5ec/pysiril-0.0.15-py3-none-any.whl"
         try:
-            subprocess.check_call([python_exe, "-m", "pip", "install", "--disable-pip-version-check", pysiril_url, "Pillow"])
+            subprocess.check_call([python_exe, "-m", "pip", "install", "--disable-pip-version-check", pysiril_url, "Pillow", "numpy"])
             print("Installation successful. Restarting CoreRescue...")
             args = [f'"{arg}"' if ' ' in arg else arg for arg in sys.argv]
             os.execv(python_exe, [python_exe] + args)
@@ -22,54 +27,709 @@ def check_and_install():
 
 check_and_install()
 
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
-from pysiril.siril import Siril as pySiril
+# --- DEFERRED IMPORTS ---
+# NumPy and Pillow take longer to import than the window takes to build, so they are
+# imported on first use: a Deferred stands in for the module and, once imported, replaces
+# itself in globals() so later lookups are direct. With a window, warm_up() imports them
+# in the background right away; pySiril is imported by the thread that opens Siril.
+# Tk is imported as the window is built, so batch mode also runs on a Python without Tk.
+class Deferred:
+    def __init__(self, alias, name): self.alias, self.name = alias, name
+    def load(self):
+        mod = globals()[self.alias] = importlib.import_module(self.name)
+        return mod
+    def __getattr__(self, attr): return getattr(self.load(), attr)
 
-class CoreRescue:
+np, Image, ImageTk = DEFERRED = (Deferred("np", "numpy"), Deferred("Image", "PIL.Image"), Deferred("ImageTk", "PIL.ImageTk"))
+tk, ttk, filedialog, messagebox = (Deferred("tk", "tkinter"), Deferred("ttk", "tkinter.ttk"), Deferred("filedialog", "tkinter.filedialog"), Deferred("messagebox", "tkinter.messagebox"))
+
+def warm_up():
+    with TRACE.span("imports"):
+        for mod in DEFERRED: mod.load()
+
+# --- TIMING ---
+# Every timed step (engine functions, Siril commands, display) is recorded in TRACE: a
+# rolling history per step, the breakdown of the job being collected on this thread for
+# the status panel, and, with SIRIL_TRACE=<file> (or --trace in batch mode), Chrome trace
+# events written out at exit; open the file in chrome://tracing or ui.perfetto.dev.
+class Tracer:
+    def __init__(self, path=None, history=200):
+        self.path, self.events, self.lock, self.local = path, [], threading.Lock(), threading.local()
+        self.history = defaultdict(lambda: deque(maxlen=history)) # step -> recent durations (s)
+        if path: atexit.register(self.dump)
+
+    @contextmanager
+    def collect(self, into):
+        # Steps run on this thread inside the block are also appended to into as (step, seconds)
+        prev, self.local.run = getattr(self.local, "run", None), into
+        try: yield into
+        finally: self.local.run = prev
+
+    @contextmanager
+    def span(self, name, **args):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.add(name, t0, time.perf_counter() - t0, args)
+
+    def add(self, name, t0, dt, args=None):
+        run = getattr(self.local, "run", None)
+        if run is not None: run.append((name, dt))
+        with self.lock:
+            self.history[name].append(dt)
+            # perf_counter is system-wide, so events from batch workers line up in one file
+            if self.path: self.events.append({"name": name, "ph": "X", "ts": t0 * 1e6, "dur": dt * 1e6, "pid": os.getpid(), "tid": threading.get_ident(), "args": args or {}})
+
+    def drain(self):
+        with self.lock: events, self.events = self.events, []
+        return events
+
+    def dump(self, path=None):
+        events = self.drain()
+        steps = defaultdict(list)
+        for e in events: steps[e["name"]].append(e["dur"] / 1000)
+        stats = {k: {"count": len(v), "total_ms": sum(v), "p50_ms": sorted(v)[len(v) // 2], "max_ms": max(v)} for k, v in steps.items()}
+        with open(path or self.path, "w") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms", "stepStats": stats}, f)
+
+def traced(name):
+    def wrap(fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            with TRACE.span(name): return fn(*args, **kwargs)
+        return timed
+    return wrap
+
+def breakdown(run):
+    # "asinh 12 · gauss 85 · resize 4 ms": total per step, in the order the steps first ran
+    total = {}
+    for name, dt in run: total[name] = total.get(name, 0.0) + dt
+    return " · ".join(f"{k} {v * 1000:.0f}" for k, v in total.items()) + " ms" if total else ""
+
+TRACE = Tracer(os.environ.get("SIRIL_TRACE"))
+
+# --- IN-PROCESS NUMPY ENGINE ---
+# Vectorized copies of the Siril commands used by process_image, so interactive
+# previews never leave RAM. Images are float32 (channels, rows, cols) in [0, 1],
+# rows in FITS order (bottom-up), exactly as Siril holds them after 'load'.
+
+def read_header(path):
+    # The primary header's cards (80 characters each, END left out) and where its data starts
+    with open(path, "rb") as f:
+        cards = []
+        while True:
+            block = f.read(2880)
+            if len(block) < 2880: raise ValueError(f"Truncated FITS header: {path}")
+            for i in range(0, 2880, 80):
+                card = block[i:i+80].decode("ascii", "replace")
+                if card[:8].strip() == "END": return cards, f.tell()
+                cards.append(card)
+
+# Keys that describe how the data is stored; fits_header writes its own for the output
+LAYOUT_KEYS = {"SIMPLE", "BITPIX", "NAXIS", "BZERO", "BSCALE", "BLANK", "EXTEND", "CHECKSUM", "DATASUM"}
+
+def source_cards(path):
+    # The input's header minus its layout, to carry over to a result as Siril's save does
+    # (WCS, DATE-OBS, EXPTIME, OBJECT, HISTORY...)
+    return [c for c in read_header(path)[0] if c[:8].strip() not in LAYOUT_KEYS and not c.startswith("NAXIS")]
+
+def map_fits(path):
+    # Memory-maps the primary HDU's data where it lies in the file: nothing is read or copied yet.
+    # Returns the (channels, rows, cols) big-endian view plus the scale and offset to Siril's [0, 1].
+    cards, offset = read_header(path)
+    hdr = {c[:8].strip(): c[10:].split("/")[0].strip() for c in cards if c[8:10] == "= "}
+    bitpix, naxis = int(hdr["BITPIX"]), int(hdr["NAXIS"])
+    shape = tuple(int(hdr[f"NAXIS{i}"]) for i in range(naxis, 0, -1))
+    dtype = {8: ">u1", 16: ">i2", 32: ">i4", -32: ">f4", -64: ">f8"}[bitpix]
+    data = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    scale, zero = float(hdr.get("BSCALE", 1)), float(hdr.get("BZERO", 0))
+    # Siril normalizes integer data to [0, 1] by the type's full scale. Signed 16/32-bit data
+    # without the unsigned offset in BZERO is shifted up by 2^(bitpix-1) first, as Siril does,
+    # or it would land in [-0.5, 0.5] and the stretches would clip half of it to black.
+    if bitpix > 0:
+        if bitpix > 8 and zero == 0: zero = scale * 2.0 ** (bitpix - 1)
+        full = {8: 255.0, 16: 65535.0, 32: 4294967295.0}[bitpix]
+        scale, zero = scale / full, zero / full
+    return (data[None] if data.ndim == 2 else data), scale, zero
+
+def file_stamp(path):
+    # Identifies what is in a file for cache keys: one overwritten under the same name gets a new stamp
+    try: st = os.stat(path)
+    except OSError: return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+def fits_pixels(view, scale, zero):
+    # A piece of map_fits' array as float32 in [0, 1]
+    s = view.astype(np.float32)
+    if scale != 1: s *= np.float32(scale)
+    if zero: s += np.float32(zero)
+    return s
+
+@traced("load")
+def read_fits(path, factor=1, strip_mb=64):
+    # Converts straight out of the mapped file a strip of rows at a time (byte order, BSCALE/BZERO,
+    # make_proxy binning), so the float32 result is the only full-size allocation
+    data, scale, zero = map_fits(path)
+    c, h, w = data.shape
+    h, w = h // factor * factor, w // factor * factor
+    out = np.empty((c, h // factor, w // factor), np.float32)
+    step = max(1, strip_mb * 2**20 // (c * w * 4 * factor)) * factor
+    for y in range(0, h, step):
+        s = fits_pixels(data[:, y:y + step, :w], scale, zero)
+        out[:, y // factor:(y + s.shape[1]) // factor] = make_proxy(s, factor)
+    return out
+
+@traced("asinh")
+def np_asinh(img, stretch, offset):
+    # asinh [stretch] [offset]: even-weighted luminance, colour ratios preserved
+    x = np.maximum(img - np.float32(offset), 0) / np.float32(1.0 - offset)
+    lum = x[0] if x.shape[0] == 1 else np.float32(0.3333) * (x[0] + x[1] + x[2])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = np.arcsinh(np.float32(stretch) * lum) / (lum * np.float32(np.arcsinh(stretch)))
+    k[lum == 0] = 0
+    x *= k
+    return np.clip(x, 0, 1, out=x)
+
+def satu_threshold(greens):
+    # median + sigma of the green channel, for satu. greens() yields the channel in pieces
+    # and is walked twice; the result does not depend on how the image was cut up, so a
+    # tiled export matches the in-memory one bit for bit. The median is exact (radix select
+    # on the float bits), the sums use 2^-30 fixed point so their order does not matter.
+    q = 2.0 ** 30
+    def keys(g):
+        b = g.view(np.uint32)
+        return np.where(b >> 31, ~b, b | np.uint32(1 << 31)) # float order as unsigned order
+    hist, total, n = np.zeros(65536, np.int64), 0, 0
+    for g in greens():
+        hist += np.bincount((keys(g) >> 16).ravel(), minlength=65536)
+        total += int(np.rint(g.astype(np.float64) * q).astype(np.int64).sum()); n += g.size
+    mean, cum = total / q / n, np.cumsum(hist)
+    ranks = ((n - 1) // 2, n // 2)
+    his = [int(np.searchsorted(cum, k, side="right")) for k in ranks]
+    lows, sq = {hi: np.zeros(65536, np.int64) for hi in his}, 0
+    for g in greens():
+        k = keys(g).ravel()
+        for hi in lows: lows[hi] += np.bincount(k[(k >> 16) == hi] & 0xFFFF, minlength=65536)
+        sq += int(np.rint((g.astype(np.float64) - mean) ** 2 * q).astype(np.int64).sum())
+    vals = []
+    for k, hi in zip(ranks, his):
+        lo = int(np.searchsorted(np.cumsum(lows[hi]), k - (cum[hi - 1] if hi else 0), side="right"))
+        b = np.uint32(hi << 16 | lo)
+        vals.append(float((b ^ np.uint32(1 << 31) if b >> 31 else ~b).view(np.float32)))
+    return (vals[0] + vals[1]) / 2 + math.sqrt(sq / q / n)
+
+@traced("satu")
+def np_satu(img, amount, bg_factor=1.0, thresh=None):
+    # satu [amount] [bg_factor]: HSL saturation boost above median+sigma of green
+    if img.shape[0] != 3 or amount == 0: return img
+    if thresh is None: thresh = satu_threshold(lambda: [img[1]])
+    v, m = img.max(axis=0), img.min(axis=0)
+    l = (v + m) * np.float32(0.5)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = (v - m) / np.where(l <= 0.5, v + m, 2 - v - m)
+        s_new = np.clip(s * np.float32(1 + amount), 0, 1)
+        ratio = np.where((s > 0) & (l > np.float32(bg_factor * thresh)), s_new / s, 1)
+    # For fixed hue and lightness RGB is affine in S, so no explicit HSL round trip
+    out = l + (img - l) * ratio.astype(np.float32)
+    return np.clip(out, 0, 1, out=out)
+
+@traced("mtf")
+def np_mtf(img, lo, mid, hi):
+    # mtf [low] [mid] [high]: midtone transfer function on the rescaled range
+    x = np.clip((img - np.float32(lo)) / np.float32(hi - lo), 0, 1)
+    m = np.float32(mid)
+    return (m - 1) * x / ((2 * m - 1) * x - m)
+
+def gauss_kernel(sigma):
+    # Same sizing as OpenCV GaussianBlur(ksize=0) on 32-bit data, which Siril calls
+    r = int(round(sigma * 4 * 2 + 1)) // 2
+    k = np.exp(-(np.arange(-r, r + 1, dtype=np.float64) ** 2) / (2 * sigma * sigma))
+    return (k / k.sum()).astype(np.float32)
+
+def convolve_axis(p, k, axis):
+    # 'valid' convolution: p already carries the kernel radius on both sides of axis
+    r = len(k) // 2
+    n = p.shape[axis] - 2 * r
+    sl = lambda i: p[(slice(None),) * axis + (slice(i, i + n),)]
+    out = sl(r) * k[r]
+    for i in range(r): out += (sl(i) + sl(2 * r - i)) * k[i]
+    return out
+
+# Above GAUSS_BOX_SIGMA the exact kernel (cost ~8*sigma per pixel) gives way to four box
+# filters of matched variance, whose cost does not depend on sigma. Against the exact
+# Gaussian the cascade's 1-D impulse response is within 5% of the kernel peak (under 10%
+# in 2-D) and a blurred [0, 1] image stays within 1e-2 (mean error about 1e-3): fine for
+# a feather mask. The boxes run on 2^-24 fixed point held as whole numbers in float64,
+# so running sums are exact and a tile gets the same numbers as the whole image.
+GAUSS_BOX_SIGMA = 8.0
+GAUSS_THREADS = os.cpu_count() or 1
+
+def box_widths(sigma, n=4):
+    # n odd box widths whose variances, (w^2 - 1) / 12 each, add up to about sigma^2
+    wl = int(math.sqrt(12 * sigma * sigma / n + 1)); wl -= 1 - wl % 2
+    m = round((12 * sigma * sigma - n * wl * wl - 4 * n * wl - 3 * n) / (-4 * wl - 4))
+    return [wl] * m + [wl + 2] * (n - m)
+
+def box_axis(p, widths, axis):
+    # 'valid' box cascade: p carries the summed box radii on both sides of axis
+    sl = lambda a, i, j: a[(slice(None),) * axis + (slice(i, j),)]
+    for w in widths:
+        c = np.cumsum(p, axis=axis)
+        p = np.empty_like(sl(c, w - 1, None))
+        sl(p, 0, 1)[...] = sl(c, w - 1, w)
+        np.subtract(sl(c, w, None), sl(c, 0, -w), out=sl(p, 1, None))
+        p *= 1 / w; np.rint(p, out=p)
+    return p
+
+def split_run(fn, p, axis):
+    # fn(p, axis) over bands of the other image axis on GAUSS_THREADS threads (NumPy drops the GIL)
+    other = 3 - axis
+    parts = min(GAUSS_THREADS, p.shape[other] // 64)
+    if parts < 2: return fn(p, axis)
+    cuts = np.linspace(0, p.shape[other], parts + 1).astype(int)
+    band = lambda i: p[(slice(None),) * other + (slice(cuts[i], cuts[i + 1]),)]
+    with ThreadPoolExecutor(parts) as pool: outs = list(pool.map(lambda i: fn(band(i), axis), range(parts)))
+    return np.concatenate(outs, axis=other)
+
+def gauss_radius(sigma):
+    if sigma <= 0: return 0
+    if sigma > GAUSS_BOX_SIGMA: return sum(w // 2 for w in box_widths(sigma))
+    return len(gauss_kernel(sigma)) // 2
+
+@traced("gauss")
+def np_gauss(img, sigma, halo=((0, 0), (0, 0))):
+    # gauss [sigma]. halo = ((top, bottom), (left, right)) rows/columns of real neighbours
+    # around the wanted area (tiled export); what the filter radius needs beyond them is the
+    # image border, filled by reflect-101 (OpenCV's BORDER_DEFAULT)
+    (t, b), (l, r_) = halo
+    if sigma <= 0: return img[:, t:img.shape[1] - b, l:img.shape[2] - r_]
+    # Rows are padded only after the row pass: same numbers, less work for wide radii
+    r = gauss_radius(sigma)
+    pad = lambda a, axis, n0, n1: np.pad(a, [(n0, n1) if i == axis else (0, 0) for i in range(3)], mode="reflect")
+    if sigma <= GAUSS_BOX_SIGMA:
+        k = gauss_kernel(sigma)
+        run = lambda a, axis: convolve_axis(a, k, axis)
+        p = split_run(run, pad(img, 2, r - l, r - r_), 2)
+        return split_run(run, pad(p, 1, r - t, r - b), 1)
+    widths = box_widths(sigma)
+    run = lambda a, axis: box_axis(a, widths, axis)
+    q = np.rint(img * np.float32(2**24)).astype(np.float64)
+    q = split_run(run, pad(q, 2, r - l, r - r_), 2)
+    return split_run(run, pad(q, 1, r - t, r - b), 1).astype(np.float32) * np.float32(2**-24)
+
+def fits_header(shape, extra=()):
+    # 32-bit float, the format Siril itself saves; extra: further cards, e.g. source_cards()
+    c, h, w = shape
+    axes = (w, h) + ((c,) if c > 1 else ())
+    cards = [f"SIMPLE  = {'T':>20}", f"BITPIX  = {-32:>20}", f"NAXIS   = {len(axes):>20}"]
+    cards += [f"NAXIS{i}  = {n:>20}" for i, n in enumerate(axes, 1)]
+    hdr = "".join(c.ljust(80) for c in cards + list(extra) + ["END"])
+    return hdr.ljust(-(-len(hdr) // 2880) * 2880).encode("ascii", "replace")
+
+@traced("save")
+def write_fits(path, img):
+    with open(path, "wb") as f:
+        f.write(fits_header(img.shape))
+        data = np.ascontiguousarray(img if img.shape[0] > 1 else img[0], dtype=">f4").tobytes()
+        f.write(data + b"\0" * (-len(data) % 2880))
+
+def make_proxy(img, factor):
+    # factor x factor mean binning; a partial bin at the right/top edge is dropped
+    if factor <= 1: return img
+    c, h, w = img.shape
+    h, w = h // factor * factor, w // factor * factor
+    return img[:, :h, :w].reshape(c, h // factor, factor, w // factor, factor).mean(axis=(2, 4), dtype=np.float32)
+
+@traced("8-bit")
+def to_preview(img):
+    # savejpg equivalent: 8-bit, rows flipped to top-down display order
+    u8 = (np.clip(img[:, ::-1], 0, 1) * 255 + 0.5).astype(np.uint8)
+    return Image.fromarray(u8[0]) if u8.shape[0] == 1 else Image.fromarray(np.ascontiguousarray(u8.transpose(1, 2, 0)))
+
+# --- TONE CURVES ---
+# Runs of pointwise stages, e.g. (("asinh", (stretch, bp)), ("mtf", (lo, mid, hi))).
+# Integer FITS read at full resolution go through one lookup table with an entry per
+# stored value, built by running the same NumPy code over every possible value: the
+# result is exact and costs one gather per pixel whatever the run. Tables are cached by
+# their parameters. Float input (binned previews, 32-bit FITS) is evaluated directly,
+# since vectorized NumPy beats an interpolated table gather there by 3-4x.
+CURVES = {"asinh": np_asinh, "mtf": np_mtf}
+
+def run_curve(img, stages):
+    for name, params in stages: img = CURVES[name](img, *params)
+    return img
+
+@lru_cache(maxsize=32)
+@traced("lut build")
+def curve_table(stages, dtype, scale, zero):
+    info = np.iinfo(dtype)
+    return run_curve(fits_pixels(np.arange(info.min, info.max + 1).astype(dtype)[None, None], scale, zero), stages)[0, 0]
+
+def curve_input(path, img, factor):
+    # What apply_curve should read: the mapped stored values when a table applies, else img
+    data, scale, zero = mapped = map_fits(path)
+    return mapped if factor == 1 and data.dtype.kind in "iu" and data.dtype.itemsize <= 2 else img
+
+def apply_curve(src, stages):
+    # src: a float32 image, or (stored values, scale, zero) as from map_fits.
+    # asinh mixes the channels of a colour image, so only mono asinh is pointwise.
+    if isinstance(src, tuple):
+        data, scale, zero = src
+        if data.dtype.kind in "iu" and data.dtype.itemsize <= 2 and (data.shape[0] == 1 or all(n != "asinh" for n, _ in stages)):
+            table = curve_table(stages, data.dtype.str, scale, zero)
+            with TRACE.span("lut"):
+                if data.dtype.kind == "u": return table[data]
+                return table[data.view(data.dtype.str.replace("i", "u")) ^ (1 << (8 * data.dtype.itemsize - 1))]
+        src = fits_pixels(data, scale, zero)
+    return run_curve(src, stages)
+
+# --- TILED EXPORT ---
+# Final saves of images too big for RAM: tile(y0, y1, x0, x1) computes one piece of the
+# result from the memory-mapped input (with whatever halo its blurs need) and the piece
+# goes straight to its place in the output file. Peak memory follows EXPORT_MB, not the
+# image size, and the pixels are identical to an in-memory run.
+EXPORT_MB = int(os.environ.get("SIRIL_EXPORT_MB", 4096))
+TILE_COPIES = 16 # float32 working copies of a tile (inputs, stages, blur padding)
+
+def tile_grid(shape, halo, budget_mb):
+    # Every tile is computed over its halo too, so tiles are at least halo (and 64) px a side:
+    # the work per tile then stays under 9x its own pixels. A budget too small for that is
+    # raised to the minimum, with a warning, rather than cutting the halo short.
+    c, h, w = shape
+    px, least = budget_mb * 2**20 // (TILE_COPIES * 4 * c), max(64, halo) # pixels a tile may hold, halo included
+    need = min(h, least + 2 * halo) * min(w, least + 2 * halo)
+    if px < need:
+        print(f"CoreRescue: a {halo} px blur halo needs {-(-need * TILE_COPIES * 4 * c // 2**20)} MB per tile, more than the {budget_mb} MB budget; using that instead")
+        px = need
+    if (least + 2 * halo) * w <= px: th, tw = min(h, max(least, px // w - 2 * halo)), w # full-width bands: halo above and below only
+    else: th = tw = max(least, math.isqrt(px) - 2 * halo)
+    th, tw = min(h, th), min(w, tw)
+    return [(y, min(y + th, h), x, min(x + tw, w)) for y in range(0, h, th) for x in range(0, w, tw)]
+
+@traced("export")
+def export_tiled(path, fmt, shape, tile, halo, budget_mb=EXPORT_MB, cards=()):
+    # cards: header cards for a FITS result, besides its layout
+    c, h, w = shape
+    grid = tile_grid(shape, halo, budget_mb)
+    if fmt == "fits":
+        with open(path, "wb") as f:
+            f.write(fits_header(shape, cards))
+            base = f.tell(); f.truncate(base + -(-c * h * w * 4 // 2880) * 2880)
+            for y0, y1, x0, x1 in grid:
+                out = tile(y0, y1, x0, x1).astype(">f4")
+                for ch in range(c):
+                    if x1 - x0 == w: f.seek(base + (ch * h + y0) * w * 4); f.write(out[ch].tobytes())
+                    else:
+                        for y in range(y0, y1): f.seek(base + ((ch * h + y) * w + x0) * 4); f.write(out[ch, y - y0].tobytes())
+    else:
+        # The JPEG encoder wants the whole picture, but only as 8-bit
+        u8 = np.empty((h, w, c), np.uint8)
+        for y0, y1, x0, x1 in grid:
+            u8[h - y1:h - y0, x0:x1] = (np.clip(tile(y0, y1, x0, x1)[:, ::-1], 0, 1) * 255 + 0.5).astype(np.uint8).transpose(1, 2, 0)
+        Image.fromarray(u8[:, :, 0] if c == 1 else u8).save(path, quality=95)
+
+# --- STAGE CACHE ---
+# process_image as a small DAG: each stage is keyed by its own parameters plus the
+# keys of the stages it reads, so a slider only recomputes the branch it feeds.
+# Results live in an LRU bounded by CACHE_MB.
+CACHE_MB = 2048
+PROXY_CHOICES = {"Auto": 0, "Full": 1, "1/2": 2, "1/4": 4, "1/8": 8}
+
+class StageGraph:
+    def __init__(self, cache_mb=CACHE_MB):
+        self.stages, self.entries, self.nbytes, self.max_bytes = {}, OrderedDict(), 0, cache_mb << 20
+        self.lock = threading.Lock() # sweeps read one graph from several threads
+
+    def add(self, name, fn, params=(), deps=()):
+        # fn(*dep_results, *param_values)
+        self.stages[name] = (fn, tuple(params), tuple(deps))
+
+    def key(self, name, p):
+        fn, params, deps = self.stages[name]
+        return (name, tuple(p[k] for k in params), tuple(self.key(d, p) for d in deps))
+
+    def get(self, name, p, check=None):
+        fn, params, deps = self.stages[name]
+        def compute():
+            vals = [self.get(d, p, check) for d in deps]
+            if check: check()
+            return fn(*vals, *[p[k] for k in params])
+        return self.cached(self.key(name, p), compute)
+
+    def cached(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        val = compute()
+        with self.lock:
+            if key not in self.entries: self.entries[key] = val; self.nbytes += self.size(val)
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False); self.nbytes -= self.size(old)
+        return val
+
+    def clear(self):
+        # A new input makes every entry stale; drop them rather than let them age out of the LRU
+        with self.lock: self.entries.clear(); self.nbytes = 0
+
+    @staticmethod
+    def size(val):
+        if isinstance(val, np.ndarray): return val.nbytes
+        if isinstance(val, Image.Image): return val.width * val.height * len(val.getbands())
+        return 0
+
+# --- DISPLAY PYRAMID ---
+# Each preview is halved level by level once. render() takes only the on-screen part
+# of the nearest level at or above screen resolution and resamples just that, so zoom
+# and pan cost (and the bitmap handed to Tk) scale with the viewport, not the zoom.
+PYRAMID_CACHE = 6
+
+class ImagePyramid:
+    def __init__(self, img, min_side=256):
+        self.levels = [img]
+        with TRACE.span("pyramid"):
+            while min(self.levels[-1].size) >= 2 * min_side:
+                self.levels.append(self.levels[-1].reduce(2))
+        self.size = img.size
+
+    def scale(self, cw, ch, zoom):
+        # Screen pixels per full-size pixel; zoom 1.0 fits the whole image
+        return min(cw / self.size[0], ch / self.size[1]) * zoom
+
+    def render(self, cw, ch, zoom, center):
+        # center is the image point at the middle of the canvas, as fractions of width/height
+        iw, ih = self.size
+        s = self.scale(cw, ch, zoom)
+        cx, cy = center[0] * iw, center[1] * ih
+        x0, x1 = max(0.0, cx - cw / (2 * s)), min(float(iw), cx + cw / (2 * s))
+        y0, y1 = max(0.0, cy - ch / (2 * s)), min(float(ih), cy + ch / (2 * s))
+        if x1 <= x0 or y1 <= y0: return None, 0, 0
+        lvl = self.levels[min(len(self.levels) - 1, max(0, int(math.floor(math.log2(1 / s)))))]
+        fx, fy = lvl.width / iw, lvl.height / ih
+        out = (max(1, round((x1 - x0) * s)), max(1, round((y1 - y0) * s)))
+        with TRACE.span("resize"): img = lvl.resize(out, Image.Resampling.LANCZOS, box=(x0 * fx, y0 * fy, x1 * fx, y1 * fy))
+        return img, round(cw / 2 + (x0 - cx) * s), round(ch / 2 + (y0 - cy) * s)
+
+# --- SIRIL BACKEND ---
+# Command chains go to Siril as a unit: SirilBackend.run() stops at the first command that
+# fails and raises, so the caller never shows temp files a broken chain left behind, and
+# keeps (command, ok, seconds) for every command it sent. pySiril only has a synchronous
+# one-command Execute, so the chain is streamed over the one open session.
+# connect() opens the session on a background thread, so nothing waits for Siril to start
+# up until it is actually needed: run() waits for it, connected() says whether it came up.
+class SirilError(Exception): pass
+
+def pysiril_session():
+    from pysiril.siril import Siril
+    return Siril()
+
+class SirilBackend:
+    def __init__(self):
+        self.app, self.cwd, self.error, self.last, self.closed = None, None, None, [], False
+        self.ready = threading.Event(); self.ready.set() # no session until connect()
+        self.lock = threading.Lock() # hands the session over between connect() and close()
+
+    def connect(self, make=pysiril_session):
+        self.ready.clear()
+        def work():
+            try:
+                with TRACE.span("siril open"):
+                    app = make(); app.Open()
+                    self.cwd = app.get_cwd()
+                with self.lock:
+                    if not self.closed: self.app, app = app, None
+                if app: app.Close() # closed while it was opening
+            except Exception as e:
+                self.error = e; print(f"CoreRescue: could not open Siril ({e})")
+            finally: self.ready.set()
+        threading.Thread(target=work, daemon=True).start()
+
+    def connected(self):
+        self.ready.wait()
+        return self.app is not None
+
+    def close(self):
+        # Never waits for connect(): a session still opening is closed by its thread once it is up
+        with self.lock: self.closed, app, self.app = True, self.app, None
+        if app:
+            try: app.Close()
+            except Exception: pass
+
+    def run(self, cmds, check=lambda: None):
+        while not self.ready.wait(0.05): check()
+        if self.app is None: raise SirilError("Siril is not connected" + (f" ({self.error})" if self.error else ""))
+        self.last = []
+        for i, c in enumerate(cmds, 1):
+            check()
+            t0, err = time.perf_counter(), None
+            try: ok = self.app.Execute(c) is not False
+            except Exception as e: ok, err = False, e
+            self.last.append((c, ok, time.perf_counter() - t0))
+            TRACE.add("siril " + c.split()[0], t0, self.last[-1][2], {"cmd": c, "ok": ok})
+            if not ok:
+                for cmd, ok_, dt in self.last: print(f"  {'ok ' if ok_ else 'ERR'} {dt * 1000:8.1f} ms  {cmd}")
+                raise SirilError(f"Siril stopped at command {i}/{len(cmds)} '{c}'" + (f" ({err})" if err else ""))
+        return self.last
+
+class FakeSiril:
+    # Stand-in for pySiril's Siril that records and times each command, to exercise the
+    # chains without Siril. fail: text that makes a command fail; delay: seconds per command.
+    def __init__(self, fail=None, delay=0.0):
+        self.log, self.fail, self.delay = [], fail, delay
+    def Open(self): pass
+    def Close(self): pass
+    def get_cwd(self): return os.getcwd()
+    def Execute(self, cmd):
+        t0 = time.perf_counter(); time.sleep(self.delay)
+        ok = not (self.fail and self.fail in cmd)
+        self.log.append((cmd, ok, time.perf_counter() - t0))
+        return ok
+
+# --- BACKGROUND WORKER ---
+# One daemon thread runs processing jobs off the Tk main thread. Latest wins: a new
+# preview drops any queued preview and makes the running one raise Cancelled at its
+# next check(), between stages or Siril commands. Saves are never dropped.
+# Completions are handed back to the Tk event loop, which is single-threaded.
+DEBOUNCE_MS = int(os.environ.get("SIRIL_PREVIEW_DEBOUNCE_MS", 700))
+
+class Cancelled(Exception): pass
+
+class PreviewWorker:
     def __init__(self, root):
+        self.root, self.cond, self.jobs, self.results, self.generation = root, threading.Condition(), [], queue.Queue(), 0
+        threading.Thread(target=self.loop, daemon=True).start()
+        self.poll()
+
+    def submit(self, fn, done, cancellable=True):
+        # fn(check) runs on the worker; done(result, error) runs on the Tk thread
+        with self.cond:
+            self.generation += 1
+            self.jobs = [j for j in self.jobs if not j[3]] + [(self.generation, fn, done, cancellable)]
+            self.cond.notify()
+
+    def loop(self):
+        while True:
+            with self.cond:
+                while not self.jobs: self.cond.wait()
+                gen, fn, done, cancellable = self.jobs.pop(0)
+            def check():
+                if cancellable and gen != self.generation: raise Cancelled()
+            try: result, error = fn(check), None
+            except Cancelled: continue
+            except Exception as e: result, error = None, e
+            if cancellable and gen != self.generation: continue
+            self.results.put((done, result, error))
+
+    def poll(self):
+        while not self.results.empty():
+            done, result, error = self.results.get()
+            done(result, error)
+        self.root.after(30, self.poll)
+
+class CoreRescue:
+    VIEWS = {"Blend": "blend", "Core Only": "core", "Nebula Only": "neb", "Mask Map": "mask"}
+    # Siril temp file per stage, and the files each view needs (the last one is shown)
+    FILES = {"b.fits": "core", "a.fits": "neb", "mask.fits": "mask", "blend.fits": "blend"}
+    # Sliders a sweep can vary: label -> (variable, default range)
+    SWEEPS = {"Core Stretch": ("core_var", 1, 1000), "Core Black Point": ("bp_var", 0, 0.05), "Core Saturation": ("sat_var", 0, 5),
+              "Nebula Stretch": ("neb_slider_var", 0, 100), "Nebula BP": ("neb_bp_slider_var", 0, 100), "Blend Feathering": ("feather_var", 1, 200)}
+    SWEEP_DEFAULTS, SWEEP_CELL = ("Core Stretch", "Blend Feathering"), 240 # thumbnail long side
+    VIEW_FILES = {"Blend": ("b.fits", "a.fits", "mask.fits", "blend.fits"), "Core Only": ("b.fits",),
+                  "Nebula Only": ("a.fits",), "Mask Map": ("b.fits", "mask.fits")}
+
+    def __init__(self, root, use_siril=True, temp_dir=None, siril=None):
+        # root=None runs headless (batch mode): no window, plain variables, jobs run inline
         self.root = root
-        self.root.title("CoreRescue v1.5.6")
-        self.root.geometry("1550x980")
+        if root:
+            self.root.title("CoreRescue v1.5.6")
+            self.root.geometry("1550x980")
         
         self.siril_home = os.getcwd()
-        self.temp_dir = os.path.join(tempfile.gettempdir(), "core_rescue").replace("\\", "/")
+        self.temp_dir = (temp_dir or os.path.join(tempfile.gettempdir(), "core_rescue")).replace("\\", "/")
         if not os.path.exists(self.temp_dir): os.makedirs(self.temp_dir)
             
         self.base_image = ""
         self.after_id = None 
         self.zoom_level = 1.0
-        self.view_mode = tk.StringVar(value="Blend")
-        self.current_img_path = ""
+        self.view_mode = self.make_var("StringVar", "Blend")
+        self.view_center = (0.5, 0.5)
+        self.pan_anchor = (0, 0, self.view_center)
+        self.pyramid = None
+        self.pyramids = OrderedDict()
         self.label_widgets = {} 
+        self.engine_var = self.make_var("BooleanVar", True)
+        self.raw = self.raw_src = None # preview working copy, binned by self.scale; raw_src feeds apply_curve
+        self.raw_key = None
+        self.scale = 1
+        self.proxy_var = self.make_var("StringVar", "Auto")
+        self.previews, self.previews_key = {}, None # views rendered so far for one set of inputs
+        self.siril_state = {} # temp file -> stage key it currently holds
+        self.graph = self.build_graph(lambda: self.raw_src)
+        self.sweep_win = self.sweeper = None
+
+        # Variables
+        self.core_var = self.make_var("DoubleVar", 10.0)
+        self.bp_var = self.make_var("DoubleVar", 0.0)
+        self.sat_var = self.make_var("DoubleVar", 1.0)
+        self.neb_slider_var = self.make_var("DoubleVar", 30.0)
+        self.neb_bp_slider_var = self.make_var("DoubleVar", 0.0) # Internal slider 0-100
+        self.feather_var = self.make_var("DoubleVar", 15.0)
         
-        try:
-            self.app = pySiril()
-            self.app.Open()
-            time.sleep(0.5)
-            actual_home = self.app.get_cwd()
-            if actual_home: self.siril_home = actual_home
-        except: pass
+        # Siril opens in the background; the window and in-memory previews never wait for it.
+        # Without a Siril session, saving also goes through the NumPy engine.
+        self.use_siril, self.siril = use_siril, SirilBackend()
+        if use_siril: self.siril.connect((lambda: siril) if siril else pysiril_session)
+        self.changed_at = None
+        self.latency_history = deque(maxlen=100)
+        self.export_mb = EXPORT_MB
+        self.worker = PreviewWorker(self.root) if root else None
+        if root:
+            self.setup_ui()
+            self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+            threading.Thread(target=warm_up, daemon=True).start()
+            if use_siril: self.set_status("● CONNECTING TO SIRIL...", "#7f8c8d"); self.root.after(50, self.poll_siril)
+            self.root.after_idle(self.on_started)
 
-        self.setup_ui()
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+    def build_graph(self, raw):
+        # raw() gives the working image; previews and sweeps differ only in that
+        g = StageGraph()
+        g.add("core", lambda src, stamp, s, bp, sat: np_satu(apply_curve(raw(), (("asinh", (s, bp)),)), sat), ("src", "stamp", "c_str", "c_bp", "c_sat"))
+        g.add("neb", lambda src, stamp, bp, s: apply_curve(raw(), (("mtf", (bp, s, 1.0)),)), ("src", "stamp", "n_bp", "n_str"))
+        g.add("mask", np_gauss, ("feather",), ("core",))
+        g.add("blend", traced("blend")(lambda a, b, mask: a * (1 - mask) + b * mask), deps=("neb", "core", "mask"))
+        for view, stage in self.VIEWS.items(): g.add(view, to_preview, deps=(stage,))
+        return g
 
-    def run_siril_cmd(self, cmd_string):
-        try: self.app.Execute(cmd_string)
-        except: pass
+    def make_var(self, kind, value):
+        # kind: name of the tk variable class, looked up only when there is a window
+        return getattr(tk, kind)(value=value) if self.root else HeadlessVar(value)
 
     def set_status(self, text, color="#e67e22"):
+        if not self.root: return
         self.status_label.config(text=text, background=color)
         self.root.update_idletasks()
 
+    def on_started(self):
+        # Cold start: script start -> window on screen (Siril may still be connecting)
+        dt = time.perf_counter() - START
+        TRACE.add("startup", START, dt)
+        print(f"CoreRescue: window ready in {dt * 1000:.0f} ms")
+
+    def poll_siril(self):
+        if not self.siril.ready.is_set(): self.root.after(50, self.poll_siril); return
+        if self.siril.cwd: self.siril_home = self.siril.cwd
+        print(f"CoreRescue: Siril {'connected' if self.siril.app else 'unavailable'} {(time.perf_counter() - START) * 1000:.0f} ms after start")
+        if self.status_label.cget("text").startswith("● CONNECTING"):
+            self.set_status("✔ READY" if self.siril.app else "✔ READY · IN-MEMORY ONLY", "#27ae60")
+
+    def show_breakdown(self, run):
+        lat = sorted(self.latency_history)
+        self.trace_label.config(text=breakdown(run) + (f"\nmedian latency {lat[len(lat) // 2] * 1000:.0f} ms over {len(lat)} runs" if lat else ""))
+
     def load_image(self):
         path = filedialog.askopenfilename(initialdir=self.siril_home, title="Select Linear FITS")
         if path:
             self.base_image = path
             self.siril_home = os.path.dirname(path)
-            shutil.copy2(path, f"{self.temp_dir}/raw.fits")
-            self.run_siril_cmd(f'cd "{self.temp_dir}"')
+            self.graph.clear()
             self.process_image()
 
     def reset_all(self):
@@ -77,88 +737,300 @@ class CoreRescue:
         self.neb_slider_var.set(30.0); self.neb_bp_slider_var.set(0.0); self.feather_var.set(15.0)
         self.process_image()
 
-    def process_image(self, save_mode=None):
-        if not self.base_image: return
-        self.set_status("● WORKING...", "#e67e22")
-        
-        c_str, c_bp, c_sat = self.core_var.get(), self.bp_var.get(), self.sat_var.get()
-        feather = self.feather_var.get()
-        
+    def get_params(self, **values):
+        # values: slider variables to override by name (sweep cells)
+        v = lambda name: values[name] if name in values else getattr(self, name).get()
         # SENSITIVITY FIX: Quadratic scaling for BP (0 to 0.05 max)
         # Moving the slider to 50% only applies 25% of the range, making the start very fine.
-        bp_raw = self.neb_bp_slider_var.get() / 100.0
+        bp_raw = v("neb_bp_slider_var") / 100.0
         n_bp = (bp_raw ** 2) * 0.05
         
         # Extended Range Math for Nebula Stretch
-        s_val = self.neb_slider_var.get()
+        s_val = v("neb_slider_var")
         n_str = 0.5 * (0.0002 ** (s_val / 100.0)) 
-        
-        cmds = [
-            f'cd "{self.temp_dir}"',
-            'load raw.fits', f'asinh {c_str} {c_bp}', f'satu {c_sat} 1.0', 'save b.fits',
-            'load raw.fits', f'mtf {n_bp:.7f} {n_str:.7f} 1.0', 'save a.fits',
-            'load b.fits', f'gauss {feather}', 'save mask.fits',
-            'load a.fits', 'pm "$a.fits$ * (1 - $mask.fits$) + ($b.fits$ * $mask.fits$)"'
-        ]
-        
+        return {"src": self.base_image, "stamp": file_stamp(self.base_image), "c_str": v("core_var"), "c_bp": v("bp_var"), "c_sat": v("sat_var"),
+                "n_bp": n_bp, "n_str": n_str, "feather": v("feather_var")}
+
+    def proxy_params(self, p, scale=None):
+        # Previews run on the binned copy, so the mask blur radius shrinks with it
+        scale = scale or self.scale
+        return dict(p, src=(p["src"], scale), feather=p["feather"] / scale)
+
+    def proxy_hint(self):
+        cw, ch = self.canvas_size()
+        return PROXY_CHOICES[self.proxy_var.get()], cw, ch
+
+    def proxy_factor(self, src, hint):
+        # Bin factor for previews of src; only Auto depends on the window size.
+        # hint=None keeps full resolution (engine export).
+        factor, cw, ch = hint or (1, 0, 0)
+        if factor: return factor
+        c, h, w = map_fits(src)[0].shape
+        return max(1, int(min(w / cw, h / ch)))
+
+    def build_proxy(self, src, stamp, hint):
+        # The full-resolution image is only read here; previews keep just the proxy. It is
+        # keyed on the file's stamp and the bin factor, so a file saved over under the same
+        # name is read again, while resizing the window only re-reads it if the factor changes.
+        factor = self.proxy_factor(src, hint)
+        if self.raw_key == (src, stamp, factor): return
+        self.scale = factor
+        self.raw, self.raw_key = read_fits(src, factor), (src, stamp, factor)
+        self.raw_src = curve_input(src, self.raw, factor)
+
+    def process_image(self, save_mode=None, out_path=None):
+        if not self.base_image: return
+        self.set_status("● WORKING...", "#e67e22")
+        # Tk state is read here on the main thread; the job itself only sees plain values
+        job = dict(p=self.get_params(), save_mode=save_mode, out=out_path, engine=self.engine_var.get(),
+                   hint=None if save_mode else self.proxy_hint(), view=self.view_mode.get(), t0=self.changed_at or time.perf_counter(), trace=[])
+        self.changed_at = None
+        if not self.worker: return self.run_job(job, lambda: None)
+        self.worker.submit(lambda check: self.run_job(job, check), lambda res, err: self.on_result(job, res, err), cancellable=not save_mode)
+
+    def run_job(self, job, check):
+        # Worker thread: run_pipeline, with the time of each step it takes kept in job["trace"]
+        with TRACE.collect(job["trace"]): return self.run_pipeline(job, check)
+
+    def run_pipeline(self, job, check):
+        # Worker thread. Only the view being looked at is rendered; returns {view: 8-bit image}.
+        p, save_mode, view = job["p"], job["save_mode"], job["view"]
+        if not save_mode:
+            self.build_proxy(p["src"], p["stamp"], job["hint"])
+            p, job["scale"] = self.proxy_params(p), self.scale
+            if job["engine"]:
+                try: return {view: self.graph.get(view, p, check)}
+                except Cancelled: raise
+                except Exception as e: print(f"CoreRescue: in-memory engine failed ({e}), using Siril")
+
         if save_mode:
-            out_dir = os.path.dirname(self.base_image)
             ext = "fits" if save_mode == "fits" else "jpg"
-            fname = f"HDR_Rescued.{ext}"
-            cmds.append(f'save "{os.path.join(out_dir, fname).replace("\\", "/")}"' if ext=="fits" else f'savejpg "{os.path.join(out_dir, fname).replace("\\", "/")}" 95')
-        else:
-            cmds += ['savejpg _p_blend 95', 'load a.fits', 'savejpg _p_neb 95', 'load b.fits', 'savejpg _p_core 95', 'load mask.fits', 'savejpg _p_mask 95']
-
-        for c in cmds: self.run_siril_cmd(c)
-        if not save_mode: 
-            self.update_display()
-            self.set_status("✔ READY", "#27ae60")
+            out_path = (job["out"] or os.path.join(os.path.dirname(job["p"]["src"]), f"HDR_Rescued.{ext}")).replace("\\", "/")
+            # Siril holds the image four times over for the blend PixelMath; past the budget save in tiles
+            c, h, w = map_fits(p["src"])[0].shape
+            if not self.use_siril or 4 * c * h * w * 4 > self.export_mb * 2**20 or not self.siril.connected(): return self.engine_save(p, out_path, ext)
+
+        # Siril loads the original where it lies; only the binned proxy is written out
+        src = '"' + job["p"]["src"].replace("\\", "/") + '"'
+        if not save_mode and self.scale > 1:
+            src = "proxy.fits"
+            if self.siril_state.get(src) != self.raw_key:
+                write_fits(f"{self.temp_dir}/{src}", self.raw); self.siril_state[src] = self.raw_key
+
+        # Only rebuild the temp files this view needs whose stage inputs changed since the last run
+        need = self.VIEW_FILES["Blend"][:-1] if save_mode else self.VIEW_FILES[view]
+        stale = {f: self.graph.key(self.FILES[f], p) for f in need}
+        stale = {f: k for f, k in stale.items() if self.siril_state.get(f) != k}
+        cmds = [f'cd "{self.temp_dir}"']
+        if "b.fits" in stale: cmds += [f'load {src}', f'asinh {p["c_str"]} {p["c_bp"]}', f'satu {p["c_sat"]} 1.0', 'save b.fits']
+        if "a.fits" in stale: cmds += [f'load {src}', f'mtf {p["n_bp"]:.7f} {p["n_str"]:.7f} 1.0', 'save a.fits']
+        if "mask.fits" in stale: cmds += ['load b.fits', f'gauss {p["feather"]}', 'save mask.fits']
+        if save_mode or "blend.fits" in stale: cmds += ['load a.fits', 'pm "$a.fits$ * (1 - $mask.fits$) + ($b.fits$ * $mask.fits$)"']
+        
+        if save_mode:
+            cmds.append(f'save "{out_path}"' if ext=="fits" else f'savejpg "{out_path}" 95')
+        elif "blend.fits" in stale: cmds.append('save blend.fits')
+
+        # A cancelled chain may leave these half-rebuilt, so forget them until it completes
+        for f in stale: self.siril_state.pop(f, None)
+        self.siril.run(cmds, check)
+        self.siril_state.update(stale)
+        if save_mode: return {}
+        # Siril's result goes straight to the display as an 8-bit buffer, no JPEG round trip
+        f = need[-1]
+        return {view: self.graph.cached(("siril", self.siril_state[f]), lambda: to_preview(read_fits(f"{self.temp_dir}/{f}")))}
+
+    def engine_save(self, p, out_path, ext):
+        # Full-resolution export without Siril, tile by tile from the memory-mapped original
+        data, scale, zero = map_fits(p["src"])
+        c, h, w = data.shape
+        r = gauss_radius(p["feather"])
+        mapped = lambda y0, y1, x0, x1: (data[:, y0:y1, x0:x1], scale, zero)
+        stretch = lambda y0, y1, x0, x1: apply_curve(mapped(y0, y1, x0, x1), (("asinh", (p["c_str"], p["c_bp"])),))
+        grid = tile_grid(data.shape, 0, self.export_mb)
+        thresh = satu_threshold(lambda: (stretch(*t)[1] for t in grid)) if c == 3 else None # satu leaves mono alone
+        def tile(y0, y1, x0, x1):
+            # The core is computed over the halo too, since the mask blurs it
+            Y0, Y1, X0, X1 = max(0, y0 - r), min(h, y1 + r), max(0, x0 - r), min(w, x1 + r)
+            core = np_satu(stretch(Y0, Y1, X0, X1), p["c_sat"], thresh=thresh)
+            mask = np_gauss(core, p["feather"], ((y0 - Y0, Y1 - y1), (x0 - X0, X1 - x1)))
+            core = core[:, y0 - Y0:y1 - Y0, x0 - X0:x1 - X0]
+            neb = apply_curve(mapped(y0, y1, x0, x1), (("mtf", (p["n_bp"], p["n_str"], 1.0)),))
+            return neb * (1 - mask) + core * mask
+        export_tiled(out_path, ext, data.shape, tile, r, self.export_mb, source_cards(p["src"]))
+        return {}
+
+    def on_result(self, job, previews, error):
+        if error:
+            print(f"CoreRescue: processing failed ({error})")
+            self.set_status("✖ ERROR", "#c0392b"); return
+        if not job["save_mode"]: 
+            key = (job["p"], job["scale"], job["engine"])
+            if key != self.previews_key: self.previews, self.previews_key = {}, key
+            self.previews.update(previews)
+            img = self.previews.get(self.view_mode.get())
+            if img is not None:
+                with TRACE.collect(job["trace"]): self.show_image(img)
+            # Parameter change -> pixels on screen, including the debounce
+            self.latency_history.append(time.perf_counter() - job["t0"])
+            TRACE.add("latency", job["t0"], self.latency_history[-1])
+            self.set_status(f"✔ READY · {self.latency_history[-1] * 1000:.0f} ms", "#27ae60")
+            self.show_breakdown(job["trace"])
         else: 
             self.set_status("✔ SAVE COMPLETE", "#2980b9")
             messagebox.showinfo("CoreRescue", "Saved successfully!")
 
     def update_display(self):
-        m = {"Blend":"_p_blend.jpg", "Core Only":"_p_core.jpg", "Nebula Only":"_p_neb.jpg", "Mask Map":"_p_mask.jpg"}
-        self.current_img_path = f"{self.temp_dir}/{m.get(self.view_mode.get())}"
+        # View Inspector: a view is rendered the first time it is asked for, then kept
+        # until the inputs change; its upstream stages usually come from the cache
+        img = self.previews.get(self.view_mode.get())
+        if img is not None: self.show_image(img)
+        else: self.process_image()
+
+    def canvas_size(self):
+        # Headless previews (benchmarks) are sized for the default window
+        cw, ch = (self.canvas.winfo_width(), self.canvas.winfo_height()) if self.root else (0, 0)
+        return (cw, ch) if cw >= 10 else (1000, 800)
+
+    def show_image(self, img):
+        # Pyramids are kept for the last few images, so flipping between views is instant
+        entry = self.pyramids.get(id(img))
+        if entry is None or entry[0] is not img:
+            entry = self.pyramids[id(img)] = (img, ImagePyramid(img))
+            while len(self.pyramids) > PYRAMID_CACHE: self.pyramids.popitem(last=False)
+        self.pyramid = entry[1]
         self.render_image()
 
     def render_image(self):
-        if not self.current_img_path: return
+        if self.pyramid is None: return
         try:
-            img = Image.open(self.current_img_path)
-            cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
-            if cw < 10: cw, ch = 1000, 800
-            iw, ih = img.size
-            ratio = min(cw/iw, ch/ih)
-            new_size = (int(iw * ratio * self.zoom_level), int(ih * ratio * self.zoom_level))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            self.photo = ImageTk.PhotoImage(img)
+            cw, ch = self.canvas_size()
+            img, x, y = self.pyramid.render(cw, ch, self.zoom_level, self.view_center)
             self.canvas.delete("all")
-            self.canvas.create_image(cw//2, ch//2, image=self.photo, anchor="center")
-            self.canvas.config(scrollregion=self.canvas.bbox("all"))
-        except: pass
+            if img is None: return
+            with TRACE.span("photoimage"): self.photo = ImageTk.PhotoImage(img)
+            self.canvas.create_image(x, y, image=self.photo, anchor="nw")
+        except Exception as e: print(f"CoreRescue: display failed ({e})")
+
+    def fit_view(self):
+        self.zoom_level, self.view_center = 1.0, (0.5, 0.5)
+        self.render_image()
+
+    def on_wheel(self, e):
+        if self.pyramid is None: return
+        # Keep the image point under the cursor where it is
+        cw, ch = self.canvas_size()
+        iw, ih = self.pyramid.size
+        f = 1.1 if e.delta > 0 else 0.9
+        s = self.pyramid.scale(cw, ch, self.zoom_level)
+        dx, dy = (e.x - cw / 2) / s, (e.y - ch / 2) / s
+        px, py = self.view_center[0] * iw + dx, self.view_center[1] * ih + dy
+        self.zoom_level *= f
+        self.view_center = (min(1.0, max(0.0, (px - dx / f) / iw)), min(1.0, max(0.0, (py - dy / f) / ih)))
+        self.render_image()
+
+    def on_drag(self, e):
+        if self.pyramid is None: return
+        x, y, (cx, cy) = self.pan_anchor
+        s = self.pyramid.scale(*self.canvas_size(), self.zoom_level)
+        iw, ih = self.pyramid.size
+        self.view_center = (min(1.0, max(0.0, cx - (e.x - x) / s / iw)), min(1.0, max(0.0, cy - (e.y - y) / s / ih)))
+        self.render_image()
+
+
+    # --- PARAMETER SWEEP ---
+    def open_sweep(self):
+        # A grid of thumbnails over one or two sliders; clicking a cell applies its values
+        if self.sweep_win and self.sweep_win.winfo_exists(): self.sweep_win.lift(); return
+        if not self.sweeper: self.sweeper = PreviewWorker(self.root)
+        win = self.sweep_win = tk.Toplevel(self.root); win.title("Parameter Sweep")
+        ctl = ttk.Frame(win, padding=10); ctl.pack(side="top", fill="x")
+        self.sweep_axes = []
+        for row, (axis, default) in enumerate(zip(("Across", "Down"), self.SWEEP_DEFAULTS)):
+            name, lo, hi = tk.StringVar(value=default), tk.StringVar(), tk.StringVar()
+            def fill(*_, name=name, lo=lo, hi=hi):
+                if name.get() in self.SWEEPS: lo.set(self.SWEEPS[name.get()][1]); hi.set(self.SWEEPS[name.get()][2])
+            name.trace_add("write", fill); fill()
+            ttk.Label(ctl, text=axis).grid(row=row, column=0, sticky="w")
+            ttk.Combobox(ctl, textvariable=name, values=list(self.SWEEPS) + (["(none)"] if row else []), width=18, state="readonly").grid(row=row, column=1, padx=5, pady=2)
+            ttk.Label(ctl, text="from").grid(row=row, column=2); ttk.Entry(ctl, textvariable=lo, width=8).grid(row=row, column=3, padx=5)
+            ttk.Label(ctl, text="to").grid(row=row, column=4); ttk.Entry(ctl, textvariable=hi, width=8).grid(row=row, column=5, padx=5)
+            self.sweep_axes.append((name, lo, hi))
+        self.sweep_n = tk.StringVar(value="4")
+        ttk.Label(ctl, text="Grid").grid(row=0, column=6, padx=(15, 5))
+        ttk.Combobox(ctl, textvariable=self.sweep_n, values=["3", "4", "5", "6"], width=3, state="readonly").grid(row=0, column=7)
+        ttk.Button(ctl, text="Render", command=self.run_sweep).grid(row=1, column=6, columnspan=2, sticky="ew", padx=(15, 0))
+        self.sweep_grid = ttk.Frame(win, padding=10); self.sweep_grid.pack(side="top")
+        self.run_sweep()
+
+    def run_sweep(self):
+        if self.raw is None: return
+        n, axes = int(self.sweep_n.get()), []
+        for name, lo, hi in self.sweep_axes:
+            if name.get() not in self.SWEEPS: continue
+            try: axes.append((self.SWEEPS[name.get()][0], [float(v) for v in np.linspace(float(lo.get()), float(hi.get()), n)]))
+            except ValueError: return messagebox.showerror("Parameter Sweep", f"'{name.get()}' needs a numeric range", parent=self.sweep_win)
+        (x_var, xs), (y_var, ys) = axes[0], (axes[1] if len(axes) > 1 else (None, [None]))
+        cells = [dict([(x_var, x)] + ([(y_var, y)] if y_var else [])) for y in ys for x in xs]
+        # Tk state is read here; the thumbnails are rendered off the Tk thread
+        job = dict(cells=cells, params=[self.get_params(**c) for c in cells], cols=n, view=self.view_mode.get(), raw=self.raw, scale=self.scale)
+        for w in self.sweep_grid.winfo_children(): w.destroy()
+        ttk.Label(self.sweep_grid, text="Rendering...").grid()
+        self.sweeper.submit(lambda check: self.render_sweep(job, check), lambda res, err: self.on_sweep(job, res, err))
+
+    def render_sweep(self, job, check):
+        # Worker thread. All cells share one thumbnail-size input and one graph, so the branches
+        # the swept sliders do not feed are computed once; the first cell warms them, the rest
+        # fan out over threads.
+        f = max(1, -(-max(job["raw"].shape[1:]) // self.SWEEP_CELL))
+        thumb = make_proxy(job["raw"], f)
+        graph = self.build_graph(lambda: thumb)
+        scale = job["scale"] * f
+        def cell(p):
+            check()
+            return graph.get(job["view"], self.proxy_params(p, scale))
+        first = cell(job["params"][0])
+        with ThreadPoolExecutor(GAUSS_THREADS) as pool: return [first] + list(pool.map(cell, job["params"][1:]))
+
+    def on_sweep(self, job, images, error):
+        if error:
+            print(f"CoreRescue: sweep failed ({error})"); return
+        if not (self.sweep_win and self.sweep_win.winfo_exists()): return
+        for w in self.sweep_grid.winfo_children(): w.destroy()
+        labels = {var: label for label, (var, lo, hi) in self.SWEEPS.items()}
+        self.sweep_photos = []
+        for i, (values, img) in enumerate(zip(job["cells"], images)):
+            photo = ImageTk.PhotoImage(img); self.sweep_photos.append(photo)
+            text = "  ".join(f"{labels[k]} {v:.4g}" for k, v in values.items())
+            cell = tk.Label(self.sweep_grid, image=photo, text=text, compound="top", bg="#111", fg="white", font=('Helvetica', 8), cursor="hand2")
+            cell.grid(row=i // job["cols"], column=i % job["cols"], padx=2, pady=2)
+            cell.bind("<Button-1>", lambda e, v=values: self.apply_sweep(v))
+
+    def apply_sweep(self, values):
+        for k, v in values.items(): getattr(self, k).set(v)
+        self.process_image()
 
     def setup_ui(self):
         sidebar = ttk.Frame(self.root, padding=15); sidebar.pack(side="left", fill="y")
         ttk.Label(sidebar, text="CoreRescue v1.5.6", font=('Helvetica', 14, 'bold')).pack(pady=(0,10))
         
         self.status_label = tk.Label(sidebar, text="✔ READY", fg="white", background="#27ae60", font=('Helvetica', 9, 'bold'), pady=5)
-        self.status_label.pack(fill="x", pady=(0,10))
+        self.status_label.pack(fill="x")
+        # Where the last run's time went, e.g. "load 240 · asinh 31 · gauss 85 · resize 4 ms"
+        self.trace_label = ttk.Label(sidebar, text="", font=('Helvetica', 8), foreground="#7f8c8d", wraplength=230, justify="left")
+        self.trace_label.pack(fill="x", pady=(2,10))
 
         ttk.Button(sidebar, text="Load Linear FITS", command=self.load_image).pack(fill="x")
         
         v_frm = ttk.LabelFrame(sidebar, text=" View Inspector ", padding=10); v_frm.pack(fill="x", pady=10)
         for mode in ["Blend", "Core Only", "Nebula Only", "Mask Map"]:
             ttk.Radiobutton(v_frm, text=mode, variable=self.view_mode, value=mode, command=self.update_display).pack(anchor="w")
+        ttk.Checkbutton(v_frm, text="Fast In-Memory Preview", variable=self.engine_var, command=self.process_image).pack(anchor="w", pady=(5,0))
+        p_frm = ttk.Frame(v_frm); p_frm.pack(fill="x", pady=(5,0))
+        ttk.Label(p_frm, text="Preview Resolution", font=('Helvetica', 8)).pack(side="left")
+        p_box = ttk.Combobox(p_frm, textvariable=self.proxy_var, values=list(PROXY_CHOICES), width=6, state="readonly"); p_box.pack(side="right")
+        p_box.bind("<<ComboboxSelected>>", lambda e: self.process_image())
 
-        # Variables
-        self.core_var = tk.DoubleVar(value=10.0)
-        self.bp_var = tk.DoubleVar(value=0.0)
-        self.sat_var = tk.DoubleVar(value=1.0)
-        self.neb_slider_var = tk.DoubleVar(value=30.0)
-        self.neb_bp_slider_var = tk.DoubleVar(value=0.0) # Internal slider 0-100
-        self.feather_var = tk.DoubleVar(value=15.0)
-        
         # --- UI SLIDERS ---
         ttk.Label(sidebar, text="CORE CONTROLS", font=('Helvetica', 9, 'bold'), foreground="#e67e22").pack(pady=(10,0))
         self.create_slider(sidebar, "Core Stretch  (-) >> Brighter", self.core_var, (1, 1000), "{:.1f}", "core")
@@ -181,6 +1053,7 @@ class CoreRescue:
         self.create_slider(sidebar, "Blend Feathering  (-) >> Softer", self.feather_var, (1, 200), "{:.1f}", "feat")
 
         ttk.Button(sidebar, text="Reset All Settings", command=self.reset_all).pack(fill="x", pady=(15, 0))
+        ttk.Button(sidebar, text="Parameter Sweep...", command=self.open_sweep).pack(fill="x", pady=(5, 0))
         ttk.Separator(sidebar, orient="horizontal").pack(fill="x", pady=15)
         ttk.Button(sidebar, text="SAVE HDR FITS", command=lambda: self.process_image("fits")).pack(fill="x", pady=2)
         ttk.Button(sidebar, text="SAVE WEB JPG", command=lambda: self.process_image("jpg")).pack(fill="x")
@@ -188,13 +1061,14 @@ class CoreRescue:
         # Preview Area
         preview_frame = ttk.Frame(self.root); preview_frame.pack(side="right", expand=True, fill="both")
         toolbar = ttk.Frame(preview_frame); toolbar.pack(side="top", fill="x")
-        ttk.Button(toolbar, text="Fit View", command=lambda: [setattr(self, 'zoom_level', 1.0), self.render_image()]).pack(side="left", padx=5)
+        ttk.Button(toolbar, text="Fit View", command=self.fit_view).pack(side="left", padx=5)
         ttk.Label(toolbar, text="Wheel: Zoom | Drag: Pan").pack(side="left", padx=10)
 
         self.canvas = tk.Canvas(preview_frame, bg="#111", highlightthickness=0); self.canvas.pack(expand=True, fill="both")
-        self.canvas.bind("<MouseWheel>", lambda e: [setattr(self, 'zoom_level', self.zoom_level * (1.1 if e.delta > 0 else 0.9)), self.render_image()])
-        self.canvas.bind("<ButtonPress-1>", lambda e: self.canvas.scan_mark(e.x, e.y))
-        self.canvas.bind("<B1-Motion>", lambda e: self.canvas.scan_dragto(e.x, e.y, gain=1))
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<ButtonPress-1>", lambda e: setattr(self, 'pan_anchor', (e.x, e.y, self.view_center)))
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<Configure>", lambda e: self.render_image())
 
     def create_slider(self, p, l, v, r, f, key):
         fr = ttk.Frame(p); fr.pack(fill="x", pady=(5,0))
@@ -211,13 +1085,108 @@ class CoreRescue:
         ttk.Scale(p, from_=r[0], to=r[1], variable=v, orient="horizontal", command=self.on_slider).pack(fill="x")
 
     def on_slider(self, _):
+        self.changed_at = time.perf_counter()
         if self.after_id: self.root.after_cancel(self.after_id)
-        self.after_id = self.root.after(700, self.process_image)
+        self.after_id = self.root.after(DEBOUNCE_MS, self.process_image)
+
+    def close(self):
+        self.siril.close()
 
     def on_closing(self):
-        try: self.app.Close()
-        except: pass
+        self.close()
         self.root.destroy()
 
+# --- HEADLESS BATCH MODE ---
+# python CoreRescue_v1.6.py --preset m42.json --out done "night1/*.fits" -j 8
+# Presets hold the slider variables by name (JSON or TOML); missing ones keep their defaults.
+PRESET_KEYS = ("core_var", "bp_var", "sat_var", "neb_slider_var", "neb_bp_slider_var", "feather_var")
+
+class HeadlessVar:
+    # Stand-in for tk variables when there is no window
+    def __init__(self, value=None): self.value = value
+    def get(self): return self.value
+    def set(self, value): self.value = value
+
+def load_preset(path):
+    if not path: return {}
+    with open(path, "rb") as f:
+        if path.lower().endswith(".toml"):
+            import tomllib
+            preset = tomllib.load(f)
+        else: preset = json.load(f)
+    unknown = sorted(set(preset) - set(PRESET_KEYS))
+    if unknown: raise SystemExit(f"CoreRescue: unknown preset keys {unknown} (expected {', '.join(PRESET_KEYS)})")
+    return preset
+
+batch_app = None
+
+def batch_init(preset, backend, temp_root, export_mb, threads, trace=None):
+    # One CoreRescue per pool process, with its own temp dir and (Siril backend) its own Siril session
+    global batch_app, GAUSS_THREADS
+    GAUSS_THREADS = threads
+    # Trace events go back to the parent with each result, which writes the one trace file
+    atexit.unregister(TRACE.dump); TRACE.drain(); TRACE.path = trace
+    batch_app = CoreRescue(None, use_siril=backend != "numpy", temp_dir=tempfile.mkdtemp(dir=temp_root), siril=FakeSiril() if backend == "fake" else None)
+    for k, v in preset.items(): getattr(batch_app, k).set(v)
+    batch_app.export_mb = export_mb
+    import multiprocessing.util
+    multiprocessing.util.Finalize(batch_app, batch_app.close, exitpriority=10)
+
+def batch_one(path, out_path, fmt):
+    # Returns the time taken, the trace events and the Siril commands sent (none for engine saves)
+    t0 = time.perf_counter()
+    batch_app.base_image = path
+    batch_app.siril.last = []
+    batch_app.process_image(fmt, out_path)
+    return time.perf_counter() - t0, TRACE.drain(), [cmd for cmd, ok, dt in batch_app.siril.last]
+
+def main(argv):
+    ap = argparse.ArgumentParser(prog="CoreRescue", description="Apply a CoreRescue preset to many linear FITS files without the UI.")
+    ap.add_argument("inputs", nargs="+", help="linear FITS files or glob patterns")
+    ap.add_argument("--preset", help="JSON or TOML file with any of: " + ", ".join(PRESET_KEYS))
+    ap.add_argument("--out", help="output folder (default: next to each input)")
+    ap.add_argument("--format", choices=("fits", "jpg"), default="fits")
+    ap.add_argument("--backend", choices=("numpy", "siril", "fake"), default="numpy", help="numpy: in-process engine; siril: one Siril session per worker; fake: list the Siril commands for each file without running them (their outputs are not written)")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+    ap.add_argument("--memory-mb", type=int, default=EXPORT_MB, help=f"memory budget shared by all workers for tiled saves (default: {EXPORT_MB})")
+    ap.add_argument("--trace", default=TRACE.path, help="write a Chrome trace (JSON) of every step to this file (default: $SIRIL_TRACE)")
+    args = ap.parse_args(argv)
+
+    files = [f for pat in args.inputs for f in (sorted(glob.glob(pat)) or [pat])]
+    preset = load_preset(args.preset)
+    if args.out: os.makedirs(args.out, exist_ok=True)
+    def out_for(f):
+        stem = os.path.splitext(os.path.basename(f))[0]
+        return os.path.join(args.out or os.path.dirname(os.path.abspath(f)), f"{stem}_HDR_Rescued.{args.format}")
+
+    jobs, failed, times = max(1, min(args.jobs, len(files))), 0, []
+    print(f"CoreRescue: {len(files)} file(s), {jobs} worker(s), {args.backend} backend")
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="core_rescue_batch_") as temp_root:
+        with ProcessPoolExecutor(jobs, initializer=batch_init, initargs=(preset, args.backend, temp_root, args.memory_mb // jobs, max(1, (os.cpu_count() or 1) // jobs), args.trace)) as pool:
+            futures = {pool.submit(batch_one, f, out_for(f), args.format): f for f in files}
+            for fut in as_completed(futures):
+                try:
+                    dt, events, cmds = fut.result()
+                    times.append(dt); TRACE.events += events
+                    print(f"  {times[-1]:8.2f} s  {futures[fut]}")
+                    if args.backend == "fake":
+                        for cmd in cmds or ["(saved by the in-process engine, no Siril commands)"]: print(f"              {cmd}")
+                except Exception as e:
+                    failed += 1
+                    print(f"  FAILED      {futures[fut]}: {e}")
+    wall = time.perf_counter() - t0
+    if times:
+        print(f"CoreRescue: {len(times)} done in {wall:.2f} s: {len(times) / wall:.2f} files/s, "
+              f"{sum(times) / len(times):.2f} s/file per worker")
+    if args.trace:
+        # Written here, merged from the workers; the exit-time dump of $SIRIL_TRACE would overwrite it with nothing
+        atexit.unregister(TRACE.dump); TRACE.dump(args.trace)
+        print(f"CoreRescue: trace written to {args.trace}")
+    if args.backend == "fake": print(f"CoreRescue: fake backend, the Siril commands above were listed but not run")
+    if failed: print(f"CoreRescue: {failed} file(s) failed")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1: sys.exit(main(sys.argv[1:]))
     root = tk.Tk(); app = CoreRescue(root); root.mainloop()
\ No newline at end of file
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# Benchmarks for CoreRescue and StarRecombiner. Not a Siril script: run it from a terminal.
+#
+#   python benchmark.py --out base.json                          # 6/24/60/120 MP, mono and RGB
+#   python benchmark.py --sizes 6 24 --tools cr --compare base.json
+#
+# Both tools run headless on synthetic linear FITS, with no window and no Siril. Each
+# scenario loads the image, drags one slider through --steps values and then a second one
+# (like a user would, minus the debounce), puts every preview through the display pyramid,
+# then saves the full-resolution result. Scenarios run in a fresh process each, so the peak
+# RSS reported is their own. The "siril" backend sends the tools' real command chains to
+# StandInSiril, which carries them out on temp files in place of a live Siril. Before the
+# scenarios, each script's cold start is timed in fresh interpreters and its Siril backend
+# is checked to stop a command chain at the first command that fails.
+
+import os, sys, time, json, math, argparse, importlib.util, platform, re, shlex, shutil, types, tempfile
+import multiprocessing, subprocess
+from importlib.machinery import ModuleSpec
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOOLS = {"cr": "CoreRescue_v1.6.py", "sr": "StarRecombiner_v2.0.py"}
+INPUTS = {"cr": ("field",), "sr": ("starless", "starmask")}
+SIZES = (6, 24, 60, 120) # megapixels
+# Slider drags per tool, (variable, from, to): the first is dragged, then the second
+DRAGS = {"cr": (("core_var", 10.0, 200.0), ("feather_var", 15.0, 60.0)),
+         "sr": (("asinh_var", 20.0, 200.0), ("blur_var", 0.5, 3.0))}
+VIEW = {"cr": "Blend", "sr": "preview"}
+
+# --- SYNTHETIC DATA ---
+# Linear frames built from seeded components: a faint nebula of broad blobs, a bright core
+# close to saturation and a star field with a power-law brightness spread. They are written
+# a strip at a time, so 120 MP costs little memory, and kept in --data so that later runs
+# measure exactly the same pixels.
+def frame_shape(mp, channels):
+    w = int(math.sqrt(mp * 1e6 * 1.5)) # 3:2
+    return channels, int(mp * 1e6 / w), w
+
+def components(shape, seed):
+    c, h, w = shape
+    rng = np.random.default_rng(seed)
+    blobs = [(rng.uniform(0, w), rng.uniform(0, h), rng.uniform(0.05, 0.3) * w, rng.uniform(0.05, 0.3) * h,
+              rng.uniform(0.01, 0.06), rng.uniform(0.4, 1.0, c)) for _ in range(12)]
+    blobs.append((w / 2, h / 2, w / 60, w / 60, 0.95, np.ones(c))) # the core
+    n = h * w // 2000
+    stars = dict(x=rng.uniform(0, w, n), y=rng.uniform(0, h, n), sigma=rng.uniform(0.8, 2.0, n),
+                 amp=np.minimum(1.0, 0.002 + 0.002 * rng.pareto(1.5, n)), color=rng.uniform(0.6, 1.0, (n, c)))
+    return blobs, stars
+
+def render_strip(shape, comps, y0, y1, nebula=True, stars=True, noise_seed=None):
+    # Rows y0:y1 of the frame as float32 (c, rows, w)
+    c, h, w = shape
+    blobs, st = comps
+    out = np.full((c, y1 - y0, w), 0.01 if nebula else 0.0, np.float32)
+    xs, ys = np.arange(w, dtype=np.float32), np.arange(y0, y1, dtype=np.float32)
+    if nebula:
+        for cx, cy, sx, sy, amp, col in blobs:
+            out += (amp * col[:, None, None] * np.outer(np.exp(-0.5 * ((ys - cy) / sy) ** 2), np.exp(-0.5 * ((xs - cx) / sx) ** 2))).astype(np.float32)
+    if stars:
+        r = np.ceil(4 * st["sigma"]).astype(int)
+        for i in np.flatnonzero((st["y"] + r >= y0) & (st["y"] - r < y1)):
+            x, y, s, ri = st["x"][i], st["y"][i], st["sigma"][i], r[i]
+            ya, yb, xa, xb = max(y0, int(y) - ri), min(y1, int(y) + ri + 1), max(0, int(x) - ri), min(w, int(x) + ri + 1)
+            psf = np.outer(np.exp(-0.5 * ((np.arange(ya, yb) - y) / s) ** 2), np.exp(-0.5 * ((np.arange(xa, xb) - x) / s) ** 2))
+            out[:, ya - y0:yb - y0, xa:xb] += (st["amp"][i] * st["color"][i][:, None, None] * psf).astype(np.float32)
+    if noise_seed is not None: out += np.random.default_rng(noise_seed + y0).normal(0, 0.002, out.shape).astype(np.float32)
+    return np.clip(out, 0, 1, out=out)
+
+def write_frame(path, shape, strip, header):
+    # strip(y0, y1) gives rows y0:y1; header is the tools' fits_header
+    c, h, w = shape
+    rows = max(1, (64 << 20) // (c * w * 4))
+    with open(path + ".part", "wb") as f:
+        f.write(header(shape)); base = f.tell()
+        f.truncate(base + -(-c * h * w * 4 // 2880) * 2880)
+        for y0 in range(0, h, rows):
+            out = strip(y0, min(h, y0 + rows)).astype(">f4")
+            for ch in range(c): f.seek(base + (ch * h + y0) * w * 4); f.write(out[ch].tobytes())
+    os.replace(path + ".part", path)
+
+def synth_file(data_dir, kind, mp, channels, header, seed=42):
+    # kind: "field" (linear frame, CoreRescue), "starless" (stretched nebula) or "starmask" (linear stars)
+    shape = frame_shape(mp, channels)
+    path = os.path.join(data_dir, f"{kind}_{mp}mp_{'rgb' if channels == 3 else 'mono'}_s{seed}.fits")
+    if not os.path.exists(path):
+        comps = components(shape, seed + channels)
+        strip = {"field": lambda y0, y1: render_strip(shape, comps, y0, y1, noise_seed=seed),
+                 "starless": lambda y0, y1: np.sqrt(render_strip(shape, comps, y0, y1, stars=False, noise_seed=seed)),
+                 "starmask": lambda y0, y1: render_strip(shape, comps, y0, y1, nebula=False, noise_seed=seed + 1)}[kind]
+        print(f"  generating {os.path.basename(path)}"); write_frame(path, shape, strip, header)
+    return path
+
+# --- SIRIL STAND-IN ---
+class StandInSiril:
+    # Carries out the commands the tools send (cd, load, asinh, satu, mtf, gauss, pm, save,
+    # savejpg) with the tools' own NumPy code, reading and writing real files in the working
+    # directory as Siril does. The steps are called unwrapped, so in the step timings each
+    # only shows up once, as "siril <command>".
+    def __init__(self, tool=None):
+        self.tool, self.cwd, self.img = tool, os.getcwd(), None
+    def Open(self): pass
+    def Close(self): pass
+    def get_cwd(self): return self.cwd
+    def path(self, name, ext):
+        name = os.path.join(self.cwd, name)
+        return name if os.path.splitext(name)[1] else name + ext
+    def Execute(self, cmd):
+        step = lambda name: getattr(getattr(self.tool, name), "__wrapped__", getattr(self.tool, name))
+        op, *args = shlex.split(cmd)
+        if op == "cd": self.cwd = args[0]
+        elif op == "load": self.img = step("read_fits")(self.path(args[0], ".fits"))
+        elif op == "asinh": self.img = step("np_asinh")(self.img, float(args[0]), float(args[1]))
+        elif op == "satu": self.img = step("np_satu")(self.img, float(args[0]), float(args[1]))
+        elif op == "mtf": self.img = step("np_mtf")(self.img, *map(float, args))
+        elif op == "gauss": self.img = step("np_gauss")(self.img, float(args[0]))
+        elif op == "pm":
+            files = {name: step("read_fits")(self.path(name, ".fits")) for name in re.findall(r"\$([^$]+)\$", args[0])}
+            self.img = eval(re.sub(r"\$([^$]+)\$", lambda m: f"_f[{m.group(1)!r}]", args[0]), {"_f": files}).astype(np.float32)
+        elif op == "save": step("write_fits")(self.path(args[0], ".fits"), self.img)
+        elif op == "savejpg": step("to_preview")(self.img).save(self.path(args[0], ".jpg"), quality=int(args[1]) if len(args) > 1 else 100)
+        else: return False
+        return True
+
+def load_tool(name):
+    # The scripts import pySiril as they load. Where it is not installed (no Siril here) the
+    # stand-in takes its place, since every scenario passes its own Siril anyway.
+    if importlib.util.find_spec("pysiril") is None:
+        pkg, mod = types.ModuleType("pysiril"), types.ModuleType("pysiril.siril")
+        pkg.__spec__, mod.__spec__ = ModuleSpec("pysiril", None, is_package=True), ModuleSpec("pysiril.siril", None)
+        mod.Siril, pkg.siril = StandInSiril, mod
+        sys.modules.update({"pysiril": pkg, "pysiril.siril": mod})
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, TOOLS[name]))
+    tool = importlib.util.module_from_spec(spec); spec.loader.exec_module(tool)
+    return tool
+
+# --- SCENARIOS ---
+def peak_rss_mb():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    except ImportError: # Windows
+        import ctypes
+        from ctypes import wintypes
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD), ("PeakWorkingSetSize", ctypes.c_size_t)] + \
+                       [(n, ctypes.c_size_t) for n in ("WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        c = Counters(); c.cb = ctypes.sizeof(c)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb)
+        return c.PeakWorkingSetSize / 2**20
+
+def run_scenario(cfg):
+    # Child process: one tool, backend, size and channel count. Returns its measurements.
+    name, siril = cfg["tool"], cfg["backend"] == "siril"
+    tool = load_tool(name)
+    temp = tempfile.mkdtemp(prefix="siril_bench_")
+    app = (tool.CoreRescue if name == "cr" else tool.StarRecombiner)(None, use_siril=siril, temp_dir=temp, siril=StandInSiril(tool) if siril else None)
+    app.engine_var.set(not siril)
+    if name == "cr": app.base_image = cfg["files"]["field"]
+    else: app.starless_orig, app.starmask_orig = cfg["files"]["starless"], cfg["files"]["starmask"]
+
+    def preview():
+        # Parameter change -> display-ready bitmap (everything but Tk's PhotoImage)
+        t0 = time.perf_counter()
+        img = app.process_image().get(VIEW[name])
+        if img is None:
+            with tool.TRACE.span("jpeg decode"): img = tool.Image.open(f"{temp}/_preview.jpg"); img.load()
+        tool.ImagePyramid(img).render(1000, 800, 1.0, (0.5, 0.5))
+        return time.perf_counter() - t0
+
+    try:
+        first = preview() # reads and bins the input
+        lat = []
+        for var, a, b in DRAGS[name]:
+            for v in np.geomspace(a, b, cfg["steps"] + 1)[1:]:
+                getattr(app, var).set(float(v)); lat.append(preview())
+        t0 = time.perf_counter()
+        app.process_image("fits", f"{temp}/bench_out.fits")
+        save = time.perf_counter() - t0
+    finally:
+        app.close(); shutil.rmtree(temp, ignore_errors=True)
+    p50, p95 = np.percentile(lat, [50, 95])
+    steps = {k: {"count": len(v), "p50_ms": float(np.median(v)) * 1000} for k, v in tool.TRACE.history.items()}
+    return dict(cfg, first_ms=first * 1000, p50_ms=p50 * 1000, p95_ms=p95 * 1000, previews_per_s=len(lat) / sum(lat),
+                save_s=save, save_mp_per_s=cfg["mp"] / save, peak_rss_mb=peak_rss_mb(), steps=steps)
+
+# Cold start, in a fresh interpreter each time: loading the script, building a headless
+# instance (which, like the window, does not wait for Siril), then the first use of NumPy
+STARTUP_PROBE = '''import sys, time, json, types, importlib.util
+from importlib.machinery import ModuleSpec
+t0 = time.perf_counter()
+if importlib.util.find_spec("pysiril") is None: # as in load_tool
+    pkg, mod = types.ModuleType("pysiril"), types.ModuleType("pysiril.siril")
+    pkg.__spec__, mod.__spec__ = ModuleSpec("pysiril", None, is_package=True), ModuleSpec("pysiril.siril", None)
+    pkg.siril = mod; sys.modules.update({"pysiril": pkg, "pysiril.siril": mod})
+spec = importlib.util.spec_from_file_location("tool", sys.argv[1])
+tool = importlib.util.module_from_spec(spec); spec.loader.exec_module(tool)
+t1 = time.perf_counter()
+app = getattr(tool, sys.argv[2])(None, use_siril=False, temp_dir=sys.argv[3])
+t2 = time.perf_counter()
+tool.np.zeros(1)
+print(json.dumps(dict(import_ms=(t1 - t0) * 1000, init_ms=(t2 - t1) * 1000, numpy_ms=(time.perf_counter() - t2) * 1000)))
+'''
+
+def startup(name, runs=5):
+    # Median over runs; process_ms also counts the interpreter's own start-up
+    temp, rows = tempfile.mkdtemp(prefix="siril_bench_"), []
+    try:
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, os.path.join(HERE, TOOLS[name]), {"cr": "CoreRescue", "sr": "StarRecombiner"}[name], temp],
+                                 capture_output=True, text=True, check=True).stdout
+            rows.append(dict(json.loads(out.strip().splitlines()[-1]), process_ms=(time.perf_counter() - t0) * 1000))
+    finally: shutil.rmtree(temp, ignore_errors=True)
+    return {k: float(np.median([r[k] for r in rows])) for k in rows[0]}
+
+# A save's command chain sent to the tools' FakeSiril, once as is and once made to fail at
+# 'gauss': the failing run must raise SirilError, send nothing after that command and
+# leave no output file; the passing one must reach the final save. Both use their own
+# temp dir, so only the first command ('cd') differs.
+def fail_fast(name, files):
+    tool, runs = load_tool(name), {}
+    for fail in (None, "gauss"):
+        temp = tempfile.mkdtemp(prefix="siril_bench_")
+        fake = tool.FakeSiril(fail=fail)
+        app = (tool.CoreRescue if name == "cr" else tool.StarRecombiner)(None, temp_dir=temp, siril=fake)
+        if name == "cr": app.base_image = files["field"]
+        else: app.starless_orig, app.starmask_orig = files["starless"], files["starmask"]
+        out = f"{temp}/out.fits"
+        try:
+            try: app.process_image("fits", out); error = None
+            except tool.SirilError as e: error = e
+            runs[fail] = ([cmd for cmd, ok, dt in fake.log], [ok for cmd, ok, dt in fake.log], [cmd for cmd, ok, dt in app.siril.last], error, os.path.exists(out))
+        finally:
+            app.close(); shutil.rmtree(temp, ignore_errors=True)
+    (sent, oks, kept, error, saved), (full, full_oks, _, full_error, _) = runs["gauss"], runs[None]
+    ok = (full_error is None and all(full_oks) and full[-1].startswith("save ") and error is not None and not saved
+          and sent == kept and sent[1:] == full[1:len(sent)] and sent[-1].startswith("gauss") and oks == [True] * (len(sent) - 1) + [False])
+    print(f"  {name} fail-fast: {'ok' if ok else 'FAILED'} (stopped at command {len(sent)}/{len(full)} '{sent[-1] if sent else ''}': {error})")
+    return ok
+
+def label(r):
+    return f"{r['tool']} {r['backend']:6} {r['mp']:4} MP {'rgb ' if r['channels'] == 3 else 'mono'}"
+
+def compare(path, starts, results):
+    key = lambda r: (r["tool"], r["backend"], r["mp"], r["channels"])
+    with open(path) as f: doc = json.load(f)
+    old = {key(r): r for r in doc["results"] if "error" not in r}
+    print(f"Compared with {path} (new / old, below 1.00 is better):")
+    for name, s in starts.items():
+        o = doc.get("startup", {}).get(name)
+        if o: print(f"  {name} cold start x{s['process_ms'] / o['process_ms']:.2f}")
+    for r in results:
+        o = old.get(key(r))
+        if o is None or "error" in r: continue
+        print(f"  {label(r)}  p50 x{r['p50_ms'] / o['p50_ms']:.2f}  p95 x{r['p95_ms'] / o['p95_ms']:.2f}  "
+              f"save x{r['save_s'] / o['save_s']:.2f}  peak RSS x{r['peak_rss_mb'] / o['peak_rss_mb']:.2f}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time CoreRescue and StarRecombiner on synthetic FITS, without Siril or a window.")
+    ap.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="frame sizes in megapixels (default: 6 24 60 120)")
+    ap.add_argument("--channels", type=int, nargs="+", choices=(1, 3), default=[1, 3])
+    ap.add_argument("--tools", nargs="+", choices=tuple(TOOLS), default=list(TOOLS), help="cr: CoreRescue, sr: StarRecombiner")
+    ap.add_argument("--backends", nargs="+", choices=("engine", "siril"), default=["engine", "siril"],
+                    help="engine: in-memory previews, tiled saves; siril: every step through the Siril command chains")
+    ap.add_argument("--steps", type=int, default=12, help="previews per slider drag (default: 12)")
+    ap.add_argument("--data", default=os.path.join(tempfile.gettempdir(), "siril_bench_data"), help="folder the synthetic FITS are kept in between runs")
+    ap.add_argument("--out", default="benchmark.json", help="results file (default: benchmark.json)")
+    ap.add_argument("--compare", help="earlier results file to compare with")
+    args = ap.parse_args(argv)
+
+    os.makedirs(args.data, exist_ok=True)
+    starts, checks = {}, {}
+    header = load_tool("cr").fits_header
+    for name in args.tools:
+        s = starts[name] = startup(name)
+        print(f"  {name} cold start: process {s['process_ms']:5.0f} ms  (script load {s['import_ms']:4.0f} ms, init {s['init_ms']:4.0f} ms, first NumPy use {s['numpy_ms']:4.0f} ms)")
+        checks[name] = fail_fast(name, {kind: synth_file(args.data, kind, 1, 3, header) for kind in INPUTS[name]})
+    # spawn everywhere, so each scenario starts from an empty process
+    ctx, results = multiprocessing.get_context("spawn"), []
+    for mp in args.sizes:
+        for channels in args.channels:
+            for name in args.tools:
+                files = {kind: synth_file(args.data, kind, mp, channels, header) for kind in INPUTS[name]}
+                for backend in args.backends:
+                    cfg = dict(tool=name, backend=backend, mp=mp, channels=channels, shape=frame_shape(mp, channels), steps=args.steps, files=files)
+                    try:
+                        with ProcessPoolExecutor(1, mp_context=ctx) as pool: r = pool.submit(run_scenario, cfg).result()
+                        print(f"  {label(r)}  first {r['first_ms']:7.0f} ms  p50 {r['p50_ms']:6.0f} ms  p95 {r['p95_ms']:6.0f} ms  "
+                              f"{r['previews_per_s']:5.1f} previews/s  save {r['save_s']:6.2f} s  peak RSS {r['peak_rss_mb']:6.0f} MB")
+                    except Exception as e:
+                        r = dict(cfg, error=str(e)); print(f"  {label(r)}  FAILED: {e}")
+                    results.append(r)
+
+    meta = dict(date=time.strftime("%Y-%m-%d %H:%M:%S"), python=platform.python_version(), numpy=np.__version__,
+                platform=platform.platform(), cpus=os.cpu_count(), steps=args.steps)
+    with open(args.out, "w") as f: json.dump({"meta": meta, "startup": starts, "checks": checks, "results": results}, f, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare: compare(args.compare, starts, results)
+    return 1 if any("error" in r for r in results) or not all(checks.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())